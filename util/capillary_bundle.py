@@ -29,39 +29,47 @@ if __name__ == '__main__':
     arg = parser.parse_args()
 
     # Reading centerlines.json
-    with open(arg.out_folder + '/centerlines.json', mode='r') as file:
-        data = json.load(file, encoding='utf-8')
+    with open(arg.out_folder + '/centerlines.json', mode='rb') as file:
+        data = json.loads(file.read())
 
     # Extract link geometry arrays from JSON and calculate derived quantities
-    edges = sorted(data['graph']['edges'], key=lambda edge: int(edge['id']))
+    edges = data['graph']['edges']
+    if not (data['graph'].get('metadata') or {}).get('ids_sorted', False):
+        edges = sorted(edges, key=lambda edge: int(edge['id']))
     link_squared_radius = np.array([edge['metadata']['link_squared_radius'] for edge in edges],
                                    dtype=np.double)
 
     # Sample random capillaries from file
+    rng = np.random.default_rng()
     N = link_squared_radius.size if (arg.number is None) else arg.number
-    idx = np.random.randint(link_squared_radius.size, size=N)
+    idx = rng.integers(link_squared_radius.size, size=N)
     R2 = link_squared_radius[idx]
     L = np.sqrt(np.pi * R2.sum() / arg.porosity)
 
     # Calculate node positions
-    x = np.array([(i % 2) * L for i in range(2 * N)])
-    y = np.random.rand(N) * L
-    z = np.random.rand(N) * L
+    x = np.tile([0.0, L], N)
+    y = rng.random(N) * L
+    z = rng.random(N) * L
+
+    # Convert each array to a Python list once, before the per-node loops below
+    x, y, z, R2 = x.tolist(), y.tolist(), z.tolist(), R2.tolist()
+    L = float(L)
 
     # Create graph metadata JSON object
     graph_metadata_obj = {'number_of_nodes': 2 * N,
-                          'number_of_links': N}
+                          'number_of_links': N,
+                          'ids_sorted': True}
 
     # Create nodes JSON object
     nodes_obj = [
         {
             'id': str(i),
             'metadata': {
-                'node_squared_radius': R2[int(i/2)],
+                'node_squared_radius': R2[i // 2],
                 'node_coordinates': {
                     'x': x[i],
-                    'y': y[int(i/2)],
-                    'z': z[int(i/2)]
+                    'y': y[i // 2],
+                    'z': z[i // 2]
                 }
             }
         } for i in range(graph_metadata_obj['number_of_nodes'])]
@@ -88,4 +96,4 @@ if __name__ == '__main__':
 
     # Save output centerlines file with capillary bundle
     with open(arg.out_folder + '/capillary_bundle.json', 'w') as file:
-        json.dump(json_obj, file)
+        file.write(json.dumps(json_obj))
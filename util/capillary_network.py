@@ -2,7 +2,6 @@
 
 import argparse
 import json
-from random import choices
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -13,6 +12,30 @@ To generate this capillary network, we take into account the distributions of po
 capillary length and connectivity.
 """
 
+
+def face(a_vals, b_vals, c_val, axis, out):
+    """
+    Fills out with the grid points of a face normal to the given axis, located at c_val along
+    that axis and spanned by a_vals and b_vals along the two remaining axes.
+    """
+    A, B = np.meshgrid(a_vals, b_vals, indexing='ij')
+    a_axis, b_axis = [k for k in range(3) if k != axis]
+    out[:, a_axis] = A.ravel()
+    out[:, b_axis] = B.ravel()
+    out[:, axis] = c_val
+
+
+def csr(rows, values, n_rows):
+    """
+    Groups values by row in CSR layout. Returns indptr and the values sorted by row, such that
+    the values of row i are values[indptr[i]:indptr[i+1]], in their original order.
+    """
+    order = np.argsort(rows, kind='stable')
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, values[order]
+
+
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description='Generates 2D or 3D network from the centerline.')
 parser.add_argument('out_folder',
@@ -64,6 +87,17 @@ parser.add_argument('--filename',
                     metavar='FILENAME.json',
                     default='centerlines.json',
                     help='Name of the input JSON file.')
+parser.add_argument('--plot',
+                    action='store_true',
+                    default=False,
+                    help='Save plots of the generated network at every iteration.')
+parser.add_argument('--seed',
+                    type=int,
+                    action='store',
+                    required=False,
+                    metavar='SEED',
+                    default=None,
+                    help='Seed of the random number generator, for reproducible networks.')
 arg = parser.parse_args()
 
 # ------------------------------------------------------------------
@@ -88,27 +122,39 @@ ds_ad = arg.capillary_length/arg.voxel_size
 delta_ad = arg.delta/arg.voxel_size
 Npoints = Nx*Ny*Nz
 
+# Random number generator for the network generation
+rng = np.random.default_rng(arg.seed)
+
 # Reading centerlines.json obtained from micro CT scan rock tomography
-with open(arg.out_folder + '/' + arg.filename, mode='r') as file1:
-    data = json.load(file1, encoding='utf-8')
+with open(arg.out_folder + '/' + arg.filename, mode='rb') as file1:
+    data = json.loads(file1.read())
 
 # ------------------------------------------------------------------
 #
 #              ROCK SAMPLE CENTERLINES SECTION
 #
 # ------------------------------------------------------------------
+# Files written by these scripts flag their ids as already sorted, so sorting can be skipped
+ids_sorted = (data['graph'].get('metadata') or {}).get('ids_sorted', False)
+
 # Extract node geometry arrays from JSON of rock sample centerlines
-nodes = sorted(data['graph']['nodes'], key=lambda node: int(node['id']))
-x = np.array([node['metadata']['node_coordinates']['x'] for node in nodes], dtype=float)
-y = np.array([node['metadata']['node_coordinates']['y'] for node in nodes], dtype=float)
-z = np.array([node['metadata']['node_coordinates']['z'] for node in nodes], dtype=float)
+nodes = data['graph']['nodes']
+if not ids_sorted:
+    nodes = sorted(nodes, key=lambda node: int(node['id']))
+coords_rock = np.array([(c['x'], c['y'], c['z'])
+                        for c in (node['metadata']['node_coordinates'] for node in nodes)],
+                       dtype=float)
 
 # Extract link geometry arrays from JSON of rock sample centerlines
-edges = sorted(data['graph']['edges'], key=lambda edge: int(edge['id']))
-sources = np.array([int(edge['source']) for edge in edges])
-targets = np.array([int(edge['target']) for edge in edges])
-link_length = np.array([edge['metadata']['link_length'] for edge in edges])
-link_squared_radius = np.array([edge['metadata']['link_squared_radius'] for edge in edges])
+edges = data['graph']['edges']
+if not ids_sorted:
+    edges = sorted(edges, key=lambda edge: int(edge['id']))
+sources, targets, link_length, link_squared_radius = np.array(
+    [(int(edge['source']), int(edge['target']),
+      edge['metadata']['link_length'], edge['metadata']['link_squared_radius'])
+     for edge in edges], dtype=float).T
+sources = sources.astype(int)
+targets = targets.astype(int)
 
 # Calculating the connectivity of each node of rock sample centerlines
 print('#############################################################')
@@ -119,18 +165,8 @@ print('edges = ', len(edges))
 print('#############################################################')
 print('Calculating the nodes connectivity of rock sample centerlines')
 
-connectivity = np.zeros(int(len(nodes)/500), dtype=np.int32)
-niter = int(len(nodes)/500)
-for i in range(0, int(len(nodes)/500)):
-    a = 0
-    b = 0
-    a = np.sum(sources == i)
-    b = np.sum(targets == i)
-    connectivity[i] = a + b
-    perc = ((1.0*i)/niter)*100
-    result = i % 1000
-    if result == 0:
-        print('progress in % = ', perc)
+connectivity = np.bincount(sources, minlength=len(nodes)) + \
+    np.bincount(targets, minlength=len(nodes))
 
 # Obtaining hystograms and density probability distributions of rock sample centerlines
 # Capillary diameter density of probability distribution
@@ -142,7 +178,8 @@ plt.hist(D, bins=binsD, density=True)
 plt.xlabel(r'Capillary diameter [$\mu$m]')
 plt.ylabel(r'Probability Density')
 plt.grid()
-plt.show()
+plt.savefig(arg.out_folder + '/rock-diameter.png')
+plt.clf()
 print('Cumulative probability density sum for diameter distribution = ', histD.sum())
 
 # Capillary length density of probability distribution
@@ -154,7 +191,8 @@ plt.hist(L, bins=binsL, density=True)
 plt.xlabel(r'Capillary length [$\mu$m]')
 plt.ylabel(r'Probability Density')
 plt.grid()
-plt.show()
+plt.savefig(arg.out_folder + '/rock-length.png')
+plt.clf()
 print('Cumulative probability density sum for length distribution = ', histL.sum())
 
 # Capillary connectivity density of probability distribution
@@ -167,9 +205,14 @@ plt.hist(connectivity, bins=bins_connectivity, density=True)
 plt.xlabel(r'Capillary connectivity')
 plt.ylabel(r'Probability Density')
 plt.grid()
-plt.show()
+plt.savefig(arg.out_folder + '/rock-connectivity.png')
+plt.clf()
 print('Cumulative probability density sum for connectivity = ', hist_connectivity.sum())
 
+# Sampling probabilities of the diameter and connectivity bins, used to generate the network
+p_D = histD/histD.sum()
+p_conn = hist_connectivity/hist_connectivity.sum()
+
 # ------------------------------------------------------------------
 #
 #              END OF ROCK SAMPLE CENTERLINES SECTION
@@ -208,24 +251,21 @@ while (abs(porosity_diff) > arg.epsilon):
         print('Nx,Ny,Nz', Nx, Ny, Nz)
 
     if arg.network_type == 'gabriel':
-        pts_init = np.random.rand(Npoints, 3) * [Lx_ad, Ly_ad, Lz_ad]
-        pts_tmp = []
+        pts_init = rng.random((Npoints, 3)) * [Lx_ad, Ly_ad, Lz_ad]
         if Lz_ad == 0:    # 2D - > adding inlet and outlet nodes
             nnx = int(Nx/2)
             nny = int(Ny/2)
             Lx_adnew = Lx_ad + 1
             Ly_adnew = Ly_ad + 1
-            for i in range(0, nnx):    # x direction -> inlet nodes
-                pts_tmp.append([i*(Lx_ad/nnx), 0, 0])
-            for i in range(0, nny):    # y direction -> inlet nodes
-                pts_tmp.append([0, i*(Ly_ad/nny), 0])
-            for i in range(0, len(pts_init)):
-                pts_tmp.append(pts_init[i])
-            for i in range(0, nnx):    # x direction -> outlet nodes
-                pts_tmp.append([i*(Lx_ad/nnx), Ly_ad, 0])
-            for i in range(0, nny):    # y direction -> outlet nodes
-                pts_tmp.append([Lx_ad, i*(Ly_ad/nny), 0])
-            pts = np.asarray(pts_tmp)
+            xs = np.linspace(0, Lx_ad, nnx, endpoint=False)
+            ys = np.linspace(0, Ly_ad, nny, endpoint=False)
+            pts = np.empty((2*(nnx + nny) + Npoints, 3))
+            o = np.cumsum([0, nnx, nny, Npoints, nnx, nny])
+            face(xs, [0.0], 0.0, 2, out=pts[o[0]:o[1]])      # x direction -> inlet nodes
+            face([0.0], ys, 0.0, 2, out=pts[o[1]:o[2]])      # y direction -> inlet nodes
+            pts[o[2]:o[3]] = pts_init
+            face(xs, [Ly_ad], 0.0, 2, out=pts[o[3]:o[4]])    # x direction -> outlet nodes
+            face([Lx_ad], ys, 0.0, 2, out=pts[o[4]:o[5]])    # y direction -> outlet nodes
             pn = op.network.Gabriel(shape=[Lx_adnew, Ly_adnew, Lz_ad], points=pts)
         else:    # 3D - > adding inlet and outlet nodes
             nnx = int(Nx/2)
@@ -234,27 +274,19 @@ while (abs(porosity_diff) > arg.epsilon):
             Lx_adnew = Lx_ad + 1
             Ly_adnew = Ly_ad + 1
             Lz_adnew = Lz_ad + 1
-            for i in range(0, nnx):    # xy direction -> inlet nodes
-                for j in range(0, nny):
-                    pts_tmp.append([i*(Lx_ad/nnx), j*(Ly_ad/nny), 0])
-            for i in range(0, nnx):    # xz direction -> inlet nodes
-                for k in range(0, nnz):
-                    pts_tmp.append([i*(Lx_ad/nnx), 0, k*(Lz_ad/nnz)])
-            for j in range(0, nny):    # yz direction -> inlet nodes
-                for k in range(0, nnz):
-                    pts_tmp.append([0, j*(Ly_ad/nny), k*(Lz_ad/nnz)])
-            for i in range(0, len(pts_init)):
-                pts_tmp.append(pts_init[i])
-            for i in range(0, nnx):    # xy direction -> outlet nodes
-                for j in range(0, nny):
-                    pts_tmp.append([i*(Lx_ad/nnx), j*(Ly_ad/nny), Lz_ad])
-            for i in range(0, nnx):    # xz direction -> outlet nodes
-                for k in range(0, nnz):
-                    pts_tmp.append([i*(Lx_ad/nnx), Ly_ad, k*(Lz_ad/nnz)])
-            for j in range(0, nny):    # yz direction -> outlet nodes
-                for k in range(0, nnz):
-                    pts_tmp.append([Lx_ad, j*(Ly_ad/nny), k*(Lz_ad/nnz)])
-            pts = np.asarray(pts_tmp)
+            xs = np.linspace(0, Lx_ad, nnx, endpoint=False)
+            ys = np.linspace(0, Ly_ad, nny, endpoint=False)
+            zs = np.linspace(0, Lz_ad, nnz, endpoint=False)
+            n_xy, n_xz, n_yz = nnx*nny, nnx*nnz, nny*nnz
+            pts = np.empty((2*(n_xy + n_xz + n_yz) + Npoints, 3))
+            o = np.cumsum([0, n_xy, n_xz, n_yz, Npoints, n_xy, n_xz, n_yz])
+            face(xs, ys, 0.0, 2, out=pts[o[0]:o[1]])         # xy direction -> inlet nodes
+            face(xs, zs, 0.0, 1, out=pts[o[1]:o[2]])         # xz direction -> inlet nodes
+            face(ys, zs, 0.0, 0, out=pts[o[2]:o[3]])         # yz direction -> inlet nodes
+            pts[o[3]:o[4]] = pts_init
+            face(xs, ys, Lz_ad, 2, out=pts[o[4]:o[5]])       # xy direction -> outlet nodes
+            face(xs, zs, Ly_ad, 1, out=pts[o[5]:o[6]])       # xz direction -> outlet nodes
+            face(ys, zs, Lx_ad, 0, out=pts[o[6]:o[7]])       # yz direction -> outlet nodes
             pn = op.network.Gabriel(shape=[Lx_adnew, Ly_adnew, Lz_adnew], points=pts)
 
     Ts_initial = pn['throat.conns']
@@ -266,67 +298,77 @@ while (abs(porosity_diff) > arg.epsilon):
     print('#############################################################')
     print('Generating a network with the connectivity distribution of rock sample centerlines')
 
-    for i in range(0, len(pn['pore.coords'])):
-        connect_tmp = choices(edgeshist_connectivity[:-1], hist_connectivity)
-        Ts_tmp = pn.find_neighbor_throats(pores=[i], flatten=False)
-        Ts = []
-        for j in range(0, len(Ts_tmp[0])):
-            Ts.append(Ts_tmp[0][j])
-        np.random.shuffle(Ts)
-        niter = len(pn['pore.coords'])
-        perc = ((1.0*i)/niter)*100
-        result = i % 500
-        if result == 0:
-            print('progress in % = ', perc)
-        if len(Ts) > connect_tmp[0]:
-            if connect_tmp[0] > 0:
-                dif = int(connect_tmp[0])
-                op.topotools.trim(pn, throats=Ts[dif:])
+    Npores = len(pn['pore.coords'])
+    conns = np.asarray(pn['throat.conns'])
+    target_degree = rng.choice(edgeshist_connectivity[:-1], size=Npores, p=p_conn).astype(int)
+
+    # Throats of each pore in CSR layout, shuffled within each pore: the throats of pore i are
+    # thr_ids[indptr[i]:indptr[i+1]]. Walking the pores in order, each pore keeps the first
+    # target_degree[i] of its throats still alive (pores drawing a zero target degree keep all
+    # throats) and the rest are trimmed together afterwards
+    perm = rng.permutation(conns.size)
+    indptr, thr_ids = csr(conns.ravel()[perm],
+                          np.repeat(np.arange(len(conns)), 2)[perm],
+                          Npores)
+    alive = np.ones(len(conns), dtype=bool)
+    for start, stop, limit in zip(indptr[:-1].tolist(), indptr[1:].tolist(),
+                                  target_degree.tolist()):
+        if limit > 0:
+            Ts = thr_ids[start:stop]
+            Ts = Ts[alive[Ts]]
+            alive[Ts[limit:]] = False
+    if not alive.all():
+        op.topotools.trim(pn, throats=np.where(~alive)[0])
 
     # Finding nodes with only one link (throad) and adding one more link
     print('#############################################################')
     print('Finding nodes with only one link (throad) and adding one more link')
 
+    # Initial throats in CSR layout: the targets of pore i are tgt_sorted[indptr[i]:indptr[i+1]]
+    Ts_initial = np.asarray(Ts_initial)
+    indptr, tgt_sorted = csr(Ts_initial[:, 0], Ts_initial[:, 1], Npores)
+
+    # Degree and, for pores with a single link, their only neighbour
+    conns = np.asarray(pn['throat.conns'])
+    degree = np.bincount(conns.ravel(), minlength=Npores)
+    neighbour = np.zeros(Npores, dtype=int)
+    neighbour[conns[:, 0]] = conns[:, 1]
+    neighbour[conns[:, 1]] = conns[:, 0]
+
     if Nz == 1:  # 2D network -> adding one more link to nodes with connective = 1
-        for i in range(0, len(pn['pore.coords'])):
-            Ps = pn.find_neighbor_pores(pores=i)
-            niter = len(pn['pore.coords'])
-            perc = ((1.0*i)/niter)*100
-            result = i % 500
-            if result == 0:
-                print('progress in % = ', perc)
-            if len(Ps) == 1:
-                condition = 0
-                for j in range(0, len(Ts_initial)):
-                    if Ts_initial[j][0] == i:
-                        if (Ts_initial[j][1] != Ps[0] and condition == 0):
-                            op.topotools.connect_pores(network=pn,
-                                                       pores1=[i],
-                                                       pores2=[Ts_initial[j][1]])
-                            condition = 1
+        max_new = np.ones(Npores, dtype=int)
     else:       # 3D network -> adding one or more links to nodes with connectivity = 1
-        for i in range(0, len(pn['pore.coords'])):
-            Ps = pn.find_neighbor_pores(pores=i)
-            niter = len(pn['pore.coords'])
-            perc = ((1.0*i)/niter)*100
-            result = i % 500
-            if result == 0:
-                print('progress in % = ', perc)
-            if len(Ps) == 1:
-                condition = 1
-                connect_tmp = choices(edgeshist_connectivity[:-1], hist_connectivity)
-                for j in range(0, len(Ts_initial)):
-                    if Ts_initial[j][0] == i:
-                        if (Ts_initial[j][1] != Ps[0] and condition < connect_tmp[0]):
-                            op.topotools.connect_pores(network=pn,
-                                                       pores1=[i],
-                                                       pores2=[Ts_initial[j][1]])
-                            condition = condition + 1
-
-    fig = op.topotools.plot_connections(network=pn)
-    fig = op.topotools.plot_coordinates(network=pn, c='r', s=10, fig=fig)
-    plt.savefig(arg.out_folder + '/capillary-network.png')
-    plt.clf()
+        max_new = rng.choice(edgeshist_connectivity[:-1], size=Npores, p=p_conn) - 1
+        max_new = max_new.astype(int)
+
+    # Walking the pores in order, link each pore still having a single link to its first
+    # max_new initial targets other than its neighbour. Degrees are updated as links are
+    # added, so pores that gained a link as an earlier pore's target are skipped
+    degree, neighbour = degree.tolist(), neighbour.tolist()
+    new_sources, new_targets = [], []
+    for i, (start, stop, limit) in enumerate(zip(indptr[:-1].tolist(), indptr[1:].tolist(),
+                                                 max_new.tolist())):
+        if degree[i] != 1 or limit <= 0:
+            continue
+        targets = [t for t in tgt_sorted[start:stop].tolist() if t != neighbour[i]][:limit]
+        for t in targets:
+            degree[t] += 1
+            neighbour[t] = i    # Only read while degree[t] == 1
+        degree[i] += len(targets)
+        new_sources += [i] * len(targets)
+        new_targets += targets
+    new = np.array([new_sources, new_targets], dtype=int).T
+    if len(new) != 0:
+        # Column vectors make connect_pores join the pores pairwise in batch mode
+        op.topotools.connect_pores(network=pn,
+                                   pores1=new[:, 0:1],
+                                   pores2=new[:, 1:2])
+
+    if arg.plot:
+        fig = op.topotools.plot_connections(network=pn)
+        fig = op.topotools.plot_coordinates(network=pn, c='r', s=10, fig=fig)
+        plt.savefig(arg.out_folder + '/capillary-network.png')
+        plt.clf()
 
     Net_health = pn.check_network_health()
     print(Net_health)
@@ -334,192 +376,108 @@ while (abs(porosity_diff) > arg.epsilon):
     # Fixing the network
     if len(Net_health["trim_pores"]) != 0:
         op.topotools.trim(pn, pores=(Net_health["trim_pores"]))
-        fig = op.topotools.plot_connections(network=pn)
-        fig = op.topotools.plot_coordinates(network=pn, c='r', s=10, fig=fig)
-        plt.savefig(arg.out_folder + '/capillary-network-healthy.png')
-        plt.clf()
+        if arg.plot:
+            fig = op.topotools.plot_connections(network=pn)
+            fig = op.topotools.plot_coordinates(network=pn, c='r', s=10, fig=fig)
+            plt.savefig(arg.out_folder + '/capillary-network-healthy.png')
+            plt.clf()
         print('#############################################################')
         Net_health2 = pn.check_network_health()
         print(Net_health2)
 
-    dist = np.zeros(len(pn['throat.conns']), dtype=np.float64)
-    r2 = np.zeros(len(pn['throat.conns']), dtype=np.float64)
-    for i in range(0, len(pn['throat.conns'])):
-        ii = pn['throat.conns'][i][0]
-        jj = pn['throat.conns'][i][1]
-        x1 = pn['pore.coords'][ii][0]
-        y1 = pn['pore.coords'][ii][1]
-        z1 = pn['pore.coords'][ii][2]
-        x2 = pn['pore.coords'][jj][0]
-        y2 = pn['pore.coords'][jj][1]
-        z2 = pn['pore.coords'][jj][2]
-        dist[i] = np.sqrt((x1-x2)**2 + (y1-y2)**2 + (z1-z2)**2)
-        D_tmp = choices(edgeshistD[:-1], histD)
-        r2[i] = ((D_tmp[0]/(2*arg.voxel_size*1.0e6)))**2
-
-    xmin_tmp = 100000
-    ymin_tmp = 100000
-    zmin_tmp = 100000
-    for i in range(0, len(pn['pore.coords'])):
-        if pn['pore.coords'][i][0] < xmin_tmp:
-            xmin_tmp = pn['pore.coords'][i][0]
-        if pn['pore.coords'][i][1] < ymin_tmp:
-            ymin_tmp = pn['pore.coords'][i][1]
-        if pn['pore.coords'][i][2] < zmin_tmp:
-            zmin_tmp = pn['pore.coords'][i][2]
-
-    graph_metadata_obj = {'number_of_nodes': pn['pore.coords'].shape[0],
-                          'number_of_links': pn['throat.conns'].shape[0]}
-    nodes_obj = [
-      {
-        'id': str(i),
-        'metadata': {
-            'node_squared_radius': 1,
-            'node_coordinates': {
-                'x': pn['pore.coords'][i][0] - xmin_tmp,
-                'y': pn['pore.coords'][i][1] - ymin_tmp,
-                'z': pn['pore.coords'][i][2] - zmin_tmp
-            }
-        }
-      } for i in range(pn['pore.coords'].shape[0])]
-
-    edges_obj = [
-      {
-        'id': str(i),
-        'source': str(pn['throat.conns'][i][0]),
-        'target': str(pn['throat.conns'][i][1]),
-        'metadata': {
-            'link_length': dist[i],
-            'link_squared_radius': r2[i]
-        }
-      } for i in range(pn['throat.conns'].shape[0])]
-
-    graph_obj = {'metadata': graph_metadata_obj,
-                 'nodes': nodes_obj,
-                 'edges': edges_obj}
-
-    # Build full JSON object
-    json_obj = {'graph': graph_obj}
-
-    with open(arg.out_folder + '/new-' + arg.filename, mode='w') as file2:
-        json.dump(json_obj, file2, indent=2)
+    # Throat lengths from pore coordinates and diameters sampled from the rock distribution
+    coords = np.asarray(pn['pore.coords'])
+    conns = np.asarray(pn['throat.conns'])
+    diff = coords[conns[:, 0]] - coords[conns[:, 1]]
+    dist = np.sqrt((diff * diff).sum(axis=1))
+    D_samples = rng.choice(edgeshistD[:-1], size=len(conns), p=p_D)
+    r2 = (D_samples/(2*arg.voxel_size*1.0e6))**2
 
-    file2.close()
+    # Shift pore coordinates so that the network starts at the origin
+    shifted_coords = coords - coords.min(axis=0)
 
     # ------------------------------------------------------------------
     #
     #              CAPILLARY NETWORK SECTION ANALYSIS
     #
     # ------------------------------------------------------------------
-    # Reading centerlines.json obtained from micro CT scan rock tomography
-
-    with open(arg.out_folder + '/new-' + arg.filename, mode='r') as file3:
-        data_pn = json.load(file3, encoding='utf-8')
-
-    # # Extract node geometry arrays from JSON of generated capillary network
-    nodes_pn = sorted(data_pn['graph']['nodes'], key=lambda node: int(node['id']))
-    x_pn = np.array([node['metadata']['node_coordinates']['x'] for node in nodes_pn], dtype=float)
-    y_pn = np.array([node['metadata']['node_coordinates']['y'] for node in nodes_pn], dtype=float)
-    z_pn = np.array([node['metadata']['node_coordinates']['z'] for node in nodes_pn], dtype=float)
-
-    # Extract link geometry arrays from JSON of generated capillary network
-    edges_pn = sorted(data_pn['graph']['edges'], key=lambda edge: int(edge['id']))
-    sources_pn = np.array([int(edge['source']) for edge in edges_pn])
-    targets_pn = np.array([int(edge['target']) for edge in edges_pn])
-    link_length_pn = np.array([edge['metadata']['link_length'] for edge in edges_pn])
-    link_squared_radius_pn = np.array([e['metadata']['link_squared_radius'] for e in edges_pn])
+    # Node and link geometry arrays of generated capillary network
+    sources_pn, targets_pn = conns[:, 0], conns[:, 1]
+    link_length_pn = dist.copy()
+    link_squared_radius_pn = r2.copy()
 
     # Calculating the connectivity of each node of generated capillary network
-    connectivity_pn = np.zeros(len(nodes_pn), dtype=np.int32)
-    for i in range(0, len(nodes_pn)):
-        a_pn = 0
-        b_pn = 0
-        a_pn = np.sum(sources_pn == i)
-        b_pn = np.sum(targets_pn == i)
-        connectivity_pn[i] = a_pn + b_pn
+    connectivity_pn = np.bincount(sources_pn, minlength=len(shifted_coords)) + \
+        np.bincount(targets_pn, minlength=len(shifted_coords))
 
     # Comparing the histograms from rock sample and generated capillary network
+    # (on the bins of the rock sample, so that both distributions are directly comparable)
     # Capillary diameter density of probability distribution
     D_pn = np.sqrt(link_squared_radius_pn) * 2.0 * arg.voxel_size*1e6
-    low, high = np.floor(D_pn.min()), np.ceil(D_pn.max())
-    binsD_pn = np.linspace(low, high, int(high - low) + 1)
-    histD_pn, edgeshistD_pn = np.histogram(D_pn, bins=binsD_pn, density=True)
-    plt.hist(D, bins=binsD, density=True, alpha=0.5, label='rock sample')
-    plt.hist(D_pn, bins=binsD_pn, density=True, alpha=0.5, label='gen. network')
-    plt.legend(loc='upper right')
-    plt.xlabel(r'Capillary diameter [$\mu$m]')
-    plt.ylabel(r'Probability Density')
-    plt.grid()
-    plt.savefig(arg.out_folder + '/capillary-diameter.png')
-    plt.clf()
+    histD_pn, edgeshistD_pn = np.histogram(D_pn, bins=binsD, density=True)
+    if arg.plot:
+        plt.hist(D, bins=binsD, density=True, alpha=0.5, label='rock sample')
+        plt.hist(D_pn, bins=binsD, density=True, alpha=0.5, label='gen. network')
+        plt.legend(loc='upper right')
+        plt.xlabel(r'Capillary diameter [$\mu$m]')
+        plt.ylabel(r'Probability Density')
+        plt.grid()
+        plt.savefig(arg.out_folder + '/capillary-diameter.png')
+        plt.clf()
     print('Cumulative probability density sum for diameter distribution = ', histD_pn.sum())
 
     # Capillary length density of probability distribution
     L_pn = link_length_pn*arg.voxel_size*1e6
-    low, high = np.floor(L_pn.min()), np.ceil(L_pn.max())
-    binsL_pn = np.linspace(low, high, int(high - low) + 1)
-    histL_pn, edgeshistL_pn = np.histogram(L_pn, bins=binsL_pn, density=True)
-    plt.hist(L, bins=binsL, density=True, alpha=0.5, label='rock sample')
-    plt.hist(L_pn, bins=binsL_pn, density=True, alpha=0.5, label='gen. network')
-    plt.legend(loc='upper right')
-    plt.xlabel(r'Capillary length [$\mu$m]')
-    plt.ylabel(r'Probability Density')
-    plt.grid()
-    plt.savefig(arg.out_folder + '/capillary-length.png')
-    plt.clf()
+    histL_pn, edgeshistL_pn = np.histogram(L_pn, bins=binsL, density=True)
+    if arg.plot:
+        plt.hist(L, bins=binsL, density=True, alpha=0.5, label='rock sample')
+        plt.hist(L_pn, bins=binsL, density=True, alpha=0.5, label='gen. network')
+        plt.legend(loc='upper right')
+        plt.xlabel(r'Capillary length [$\mu$m]')
+        plt.ylabel(r'Probability Density')
+        plt.grid()
+        plt.savefig(arg.out_folder + '/capillary-length.png')
+        plt.clf()
     print('Cumulative probability density sum for length distribution = ', histL_pn.sum())
 
     # Capillary connectivity density of probability distribution
-    low, high = np.floor(connectivity_pn.min()), np.ceil(connectivity_pn.max())
-    bins_connectivity_pn = np.linspace(low, high, int(high - low) + 1)
     hist_connectivity_pn, edgeshist_connectivity_pn = np.histogram(connectivity_pn,
-                                                                   bins=bins_connectivity_pn,
+                                                                   bins=bins_connectivity,
                                                                    density=True)
-    plt.hist(connectivity, bins=bins_connectivity, density=True, alpha=0.5, label='rock sample')
-    plt.hist(connectivity_pn, bins=bins_connectivity_pn, density=True, alpha=0.5, label='generated')
-    plt.legend(loc='upper right')
-    plt.xlabel(r'Capillary connectivity ')
-    plt.ylabel(r'Probability Density')
-    plt.grid()
-    plt.savefig(arg.out_folder + '/capillary-connectivity.png')
-    plt.clf()
+    if arg.plot:
+        plt.hist(connectivity, bins=bins_connectivity, density=True, alpha=0.5, label='rock sample')
+        plt.hist(connectivity_pn, bins=bins_connectivity, density=True, alpha=0.5,
+                 label='generated')
+        plt.legend(loc='upper right')
+        plt.xlabel(r'Capillary connectivity ')
+        plt.ylabel(r'Probability Density')
+        plt.grid()
+        plt.savefig(arg.out_folder + '/capillary-connectivity.png')
+        plt.clf()
     print('Cumulative probability density sum for connectivity = ', hist_connectivity_pn.sum())
 
     # Calculating the porosity
-    # Convert capillary dimensions to SI units
+    # Convert capillary dimensions to SI units (the rock sample porosity is computed once)
     if kk == 1:
         link_length *= arg.voxel_size                                                       # [m]
         link_squared_radius *= arg.voxel_size**2                                            # [m^2]
+        pore_volume = np.pi * np.einsum('i,i->', link_squared_radius, link_length)          # [m^3]
+        V_rock = np.prod(np.ptp(coords_rock, axis=0))*arg.voxel_size**3                     # [m^3]
+        porosity_rock = pore_volume/V_rock
     link_length_pn *= arg.voxel_size                                                        # [m]
     link_squared_radius_pn *= arg.voxel_size**2                                             # [m^2]
 
-    pore_volume = np.sum(np.pi * link_squared_radius * link_length)                         # [m^3]
-    pore_volume_pn = np.sum(np.pi * link_squared_radius_pn * link_length_pn)                # [m^3]
-    pore_area_pn = np.sum(np.sqrt(link_squared_radius_pn)*2.0*link_length_pn)               # [m^2]
-
-    xmax = np.amax(x)
-    ymax = np.amax(y)
-    zmax = np.amax(z)
-    xmin = np.amin(x)
-    ymin = np.amin(y)
-    zmin = np.amin(z)
-    V_rock = (xmax-xmin)*(ymax-ymin)*(zmax-zmin)*arg.voxel_size**3                          # [m^3]
-    porosity_rock = pore_volume/V_rock
-
-    xmax_pn = np.amax(x_pn)
-    ymax_pn = np.amax(y_pn)
-    zmax_pn = np.amax(z_pn)
-    xmin_pn = np.amin(x_pn)
-    ymin_pn = np.amin(y_pn)
-    zmin_pn = np.amin(z_pn)
-    r2max_pn = np.amax(link_squared_radius_pn)
-    Dmax_pn = np.sqrt(r2max_pn)*2.0
-    if (zmax_pn-zmin_pn) != 0:
-        V_pn = (xmax_pn-xmin_pn)*(ymax_pn-ymin_pn)*(zmax_pn-zmin_pn)*arg.voxel_size**3      # [m^3]
+    pore_volume_pn = np.pi*np.einsum('i,i->', link_squared_radius_pn, link_length_pn)       # [m^3]
+    pore_area_pn = 2.0*np.einsum('i,i->',
+                                 np.sqrt(link_squared_radius_pn), link_length_pn)           # [m^2]
+
+    # Bounding box of generated capillary network, in one reduction over all pores
+    extents_pn = np.ptp(shifted_coords, axis=0)*arg.voxel_size                              # [m]
+    if extents_pn[2] != 0:
+        V_pn = extents_pn[0]*extents_pn[1]*extents_pn[2]                                    # [m^3]
         porosity_pn = pore_volume_pn/V_pn
     else:
-        A_pn = (xmax_pn-xmin_pn)*(ymax_pn-ymin_pn) * \
-            arg.voxel_size**2                            # [m^2]
+        A_pn = extents_pn[0]*extents_pn[1]                                                  # [m^2]
         porosity_pn = pore_area_pn/A_pn
 
     output_file.write(str(porosity_rock)+','+str(porosity_pn)+'\n')
@@ -530,7 +488,6 @@ while (abs(porosity_diff) > arg.epsilon):
     if porosity_diff > 0:
         ds_ad = ds_ad - delta_ad
 
-    file3.close()
     kk = kk + 1
 
     print('#############################################################')
@@ -547,4 +504,46 @@ while (abs(porosity_diff) > arg.epsilon):
     print('are overlapping with each other. Try to increase the "capillary_length" parameter')
     print('in the input section')
     print('')
+
+# Save the capillary network that matches the target porosity
+# (.tolist() is called once per array while building its JSON object)
+if kk > 1:    # No network was generated if the porosity loop never ran (epsilon >= 1)
+    graph_metadata_obj = {'number_of_nodes': pn['pore.coords'].shape[0],
+                          'number_of_links': pn['throat.conns'].shape[0],
+                          'ids_sorted': True}
+    nodes_obj = [
+      {
+        'id': str(i),
+        'metadata': {
+            'node_squared_radius': 1,
+            'node_coordinates': {
+                'x': x_i,
+                'y': y_i,
+                'z': z_i
+            }
+        }
+      } for i, (x_i, y_i, z_i) in enumerate(shifted_coords.tolist())]
+
+    links = zip(conns.tolist(), dist.tolist(), r2.tolist())
+    edges_obj = [
+      {
+        'id': str(i),
+        'source': str(source),
+        'target': str(target),
+        'metadata': {
+            'link_length': length,
+            'link_squared_radius': squared_radius
+        }
+      } for i, ((source, target), length, squared_radius) in enumerate(links)]
+
+    graph_obj = {'metadata': graph_metadata_obj,
+                 'nodes': nodes_obj,
+                 'edges': edges_obj}
+
+    # Build full JSON object
+    json_obj = {'graph': graph_obj}
+
+    with open(arg.out_folder + '/new-' + arg.filename, mode='w') as file2:
+        json.dump(json_obj, file2, indent=2)
+
 print('program finished')
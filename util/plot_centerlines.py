@@ -37,14 +37,17 @@ if __name__ == '__main__':
 
     # Load centrelines input file
     with open(arg.out_folder + '/' + arg.filename + '.json', mode='rb') as file:
-        data = json.load(file, encoding='utf-8')
+        data = json.loads(file.read())
 
     # Extract node geometry arrays from JSON
-    nodes = sorted(data['graph']['nodes'], key=lambda node: int(node['id']))
-    x = np.array([node['metadata']['node_coordinates']['x'] for node in nodes])
-    y = np.array([node['metadata']['node_coordinates']['y'] for node in nodes])
-    z = np.array([node['metadata']['node_coordinates']['z'] for node in nodes])
-    R2 = np.array([node['metadata']['node_squared_radius'] for node in nodes])
+    nodes = data['graph']['nodes']
+    if not (data['graph'].get('metadata') or {}).get('ids_sorted', False):
+        nodes = sorted(nodes, key=lambda node: int(node['id']))
+    x, y, z, R2 = np.array([(node['metadata']['node_coordinates']['x'],
+                             node['metadata']['node_coordinates']['y'],
+                             node['metadata']['node_coordinates']['z'],
+                             node['metadata']['node_squared_radius']) for node in nodes],
+                           dtype=float).T
 
     # Creating 3D visualization
     mlab.figure(size=(800, 700), bgcolor=(0.1, 0.1, 0.1))
@@ -1,10 +1,39 @@
 #!/usr/bin/env python3
 
 import argparse
+import os
 
 import matplotlib.pyplot as plt
 import numpy as np
 
+
+def load_frac_plot(path):
+    """
+    Loads box sizes and box counts as a (2, N) array, cached in a .npy file. Kept in step with
+    load_stats in plot_stats.py, as the util scripts are standalone.
+    """
+    cache = path + '.npy'
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        return np.load(cache)
+    data = np.loadtxt(path, unpack=True)
+    try:
+        np.save(cache, data)
+    except OSError:
+        pass    # Cache not writable, use the parsed values
+    return data
+
+
+def fractal_dimension(size, number):
+    """
+    Returns the box-counting fractal dimension -d ln(number) / d ln(size) for every box size.
+    number may hold the box counts of several phases along its rows, all sharing size.
+    """
+    frac_dim = np.gradient(np.log(number), size, axis=-1)
+    frac_dim /= np.gradient(np.log(size), size)
+    np.negative(frac_dim, out=frac_dim)
+    return frac_dim
+
+
 if __name__ == '__main__':
 
     # Parse command-line arguments
@@ -19,24 +48,32 @@ if __name__ == '__main__':
                         default=False,
                         help='Show plot instead of saving to file.')
     arg = parser.parse_args()
+    if not arg.show:
+        plt.switch_backend('Agg')    # Headless backend when only saving to file
 
     # Creating graph for the normalised histogram
     plt.figure(dpi=125)
     plt.title("Box-counting fractal dimension", fontsize=18)
     plt.xlabel(r'$\epsilon$', fontsize=16)
     plt.ylabel(r'-$\frac{\partial \ln{N(\epsilon)}}{\partial \ln{\epsilon}}$', fontsize=16)
+    plt.xscale('log')
     plt.ylim(0, 3.1)
     plt.grid()
 
-    # Reading histogram file from output folder and fitting the curve
+    # Reading histogram files from output folder and fitting the curves of all phases at once
+    # (the box sizes are the same for every phase)
     style = {'pore': 'rs-', 'surf': 'go-', 'rock': 'bv-'}
-    for phase in ["pore", "surf", "rock"]:
-        size, number = np.loadtxt(arg.out_folder + "/" + phase + "_frac_plot.dat", unpack=True)
-        frac_dim = - np.gradient(np.log(number), size) / np.gradient(np.log(size), size)
-        plt.semilogx(size, frac_dim, style[phase], label=phase)
+    phases = ["pore", "surf", "rock"]
+    frac_plots = [load_frac_plot(arg.out_folder + "/" + phase + "_frac_plot.dat")
+                  for phase in phases]
+    size = frac_plots[0][0]
+    numbers = np.vstack([number for _, number in frac_plots])
+    for phase, frac_dim in zip(phases, fractal_dimension(size, numbers)):
+        plt.plot(size, frac_dim, style[phase], label=phase)
     plt.legend(loc='best', fancybox=True, shadow=True)
 
     if (arg.show):
         plt.show()
     else:
-        plt.savefig(arg.out_folder + "/frac_plot.png", dpi=125, bbox_inches='tight')
+        plt.savefig(arg.out_folder + "/frac_plot.png", dpi=125, bbox_inches='tight',
+                    pil_kwargs={'compress_level': 1})
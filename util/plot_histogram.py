@@ -5,6 +5,28 @@ import sys
 import matplotlib.pyplot as plt
 import numpy as np
 
+
+def plot_histogram(bins, hist, t, title, ylabel, path):
+    """
+    Plots a greyscale histogram as a single step-shaped patch, marks threshold t and the pore
+    and solid regions on either side of it, and saves the figure to path.
+    """
+    hist_max = hist.max()
+    plt.clf()
+    plt.fill_between(bins, 0, hist, step='mid', color='red', linewidth=0)
+    plt.axvline(x=t, linewidth=1.5, color='black', linestyle='--')
+    plt.axis([0, 256, 0, hist_max])
+    plt.text(t / 2, hist_max / 2, "pore\nspace", fontsize=16, ha='center')
+    plt.text(t + (256 - t) / 2, hist_max / 2, "solid\nspace", fontsize=16,
+             ha='center')
+    plt.title(title, fontsize=18)
+    plt.xlabel("Greyscale level [0-255]", fontsize=16)
+    plt.ylabel(ylabel, fontsize=16)
+    plt.savefig(path, dpi=125, bbox_inches='tight', pil_kwargs={'compress_level': 1})
+
+
+plt.switch_backend('Agg')    # Headless backend, plots are only saved to file
+
 # Read threshold and output folder from stdin
 t = float(sys.argv[1])
 output_folder = sys.argv[2]
@@ -13,28 +35,9 @@ output_folder = sys.argv[2]
 bins, norm_hist, accu_hist = np.loadtxt(output_folder + "/histogram.dat",
                                         unpack=True)
 
-# Creating graph for the normalised histogram
-plt.figure(dpi=125)
-plt.bar(bins, norm_hist, width=1, color='red', linewidth=0)
-plt.axvline(x=t, linewidth=1.5, color='black', linestyle='--')
-plt.axis([0, 256, 0, norm_hist.max()])
-plt.text(t / 2, norm_hist.max() / 2, "pore\nspace", fontsize=16, ha='center')
-plt.text(t + (256 - t) / 2, norm_hist.max() / 2, "solid\nspace", fontsize=16,
-         ha='center')
-plt.title("Normalised histogram", fontsize=18)
-plt.xlabel("Greyscale level [0-255]", fontsize=16)
-plt.ylabel("Normalised frequency", fontsize=16)
-plt.savefig(output_folder + "/norm_hist.png", dpi=125, bbox_inches='tight')
-
-# Creating graph for the accumulated histogram
+# Creating graphs for the normalised and accumulated histograms, reusing one figure
 plt.figure(dpi=125)
-plt.bar(bins, accu_hist, width=1, color='red', linewidth=0)
-plt.axvline(x=t, linewidth=1.5, color='black', linestyle='--')
-plt.axis([0, 256, 0, accu_hist.max()])
-plt.text(t/2, accu_hist.max()/2, "pore\nspace", fontsize=16, ha='center')
-plt.text(t+(256-t)/2, accu_hist.max()/2, "solid\nspace", fontsize=16,
-         ha='center')
-plt.title("Accumulated histogram", fontsize=18)
-plt.xlabel("Greyscale level [0-255]", fontsize=16)
-plt.ylabel("Accumulated frequency", fontsize=16)
-plt.savefig(output_folder + "/accu_hist.png", dpi=125, bbox_inches='tight')
+plot_histogram(bins, norm_hist, t, "Normalised histogram", "Normalised frequency",
+               output_folder + "/norm_hist.png")
+plot_histogram(bins, accu_hist, t, "Accumulated histogram", "Accumulated frequency",
+               output_folder + "/accu_hist.png")
@@ -1,10 +1,28 @@
 #!/usr/bin/env python3
 
 import argparse
+import os
 
 import matplotlib.pyplot as plt
 import numpy as np
 
+
+def load_stats(path):
+    """
+    Loads length, tortuosity and diameter as an (N, 3) array, cached in a .npy file. Kept in
+    step with load_frac_plot in plot_fractal.py, as the util scripts are standalone.
+    """
+    cache = path + '.npy'
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        return np.load(cache)
+    data = np.loadtxt(path, delimiter=',', dtype=float, usecols=[0, 1, 2], ndmin=2)
+    try:
+        np.save(cache, data)
+    except OSError:
+        pass    # Cache not writable, use the parsed values
+    return data
+
+
 if __name__ == '__main__':
 
     # Parse command-line arguments
@@ -20,51 +38,55 @@ if __name__ == '__main__':
                         type=float,
                         help='Voxel size [m].')
     arg = parser.parse_args()
+    plt.switch_backend('Agg')    # Headless backend, plots are only saved to file
 
     # Load and re-format input file
-    length, tortuosity, diameter = np.loadtxt(arg.odir + '/centerlines.stat',
-                                              delimiter=',',
-                                              dtype=float,
-                                              usecols=[0, 1, 2],
-                                              unpack=True)
+    stats = load_stats(arg.odir + '/centerlines.stat')
 
     # Filter valid entries only
-    v = (length > 0)
-    length, tortuosity, diameter = length[v], tortuosity[v], diameter[v]
+    stats = stats[stats[:, 0] > 0]
+    length, tortuosity, diameter = stats.T
 
     # Convert "voxel" units to micrometers
-    diameter *= arg.voxel / 1e-6
-    length *= arg.voxel / 1e-6
+    voxel_um = arg.voxel * 1e6
+    np.multiply(diameter, voxel_um, out=diameter)
+    np.multiply(length, voxel_um, out=length)
 
-    # Save length vs. tortuosity plot
-    plt.figure(dpi=125)
-    plt.xscale('log')
-    plt.scatter(x=length, y=tortuosity, s=40, c=diameter, cmap=plt.cm.viridis,
-                edgecolors='face', linewidths=3, alpha=0.85)
-    plt.xlabel(r'Capillary length [$\mu\mathrm{m}$]', fontsize=16)
-    plt.ylabel(r'Capillary tortuosity', fontsize=16)
-    plt.colorbar().set_label(r'Average capillary diameter [$\mu\mathrm{m}$]',
-                             size=16)
-    plt.savefig(arg.odir + "/length_tort.png", dpi=125, bbox_inches='tight')
+    # Save length vs. tortuosity plot (a single figure is reused for all plots)
+    fig, ax = plt.subplots(dpi=125)
+    ax.set_xscale('log')
+    points = ax.scatter(x=length, y=tortuosity, s=40, c=diameter, cmap=plt.cm.viridis,
+                        edgecolors='face', linewidths=3, alpha=0.85)
+    ax.set_xlabel(r'Capillary length [$\mu\mathrm{m}$]', fontsize=16)
+    ax.set_ylabel(r'Capillary tortuosity', fontsize=16)
+    colorbar = fig.colorbar(points, ax=ax)
+    colorbar.set_label(r'Average capillary diameter [$\mu\mathrm{m}$]', size=16)
+    fig.savefig(arg.odir + "/length_tort.png", dpi=125, bbox_inches='tight',
+                pil_kwargs={'compress_level': 1})
 
     # Save diameter vs. tortuosity plot
-    plt.figure(dpi=125)
-    plt.xscale('log')
-    plt.scatter(x=diameter, y=tortuosity, s=40, c=length, cmap=plt.cm.viridis,
-                edgecolors='face', alpha=0.85)
-    plt.xlabel(r'Average capillary diameter [$\mu\mathrm{m}$]', fontsize=16)
-    plt.ylabel(r'Capillary tortuosity', fontsize=16)
-    plt.colorbar().set_label(r'Capillary length [$\mu\mathrm{m}$]',
-                             size=16)
-    plt.savefig(arg.odir + "/diam_tort.png", dpi=125, bbox_inches='tight')
+    colorbar.remove()
+    ax.clear()
+    ax.set_xscale('log')
+    points = ax.scatter(x=diameter, y=tortuosity, s=40, c=length, cmap=plt.cm.viridis,
+                        edgecolors='face', alpha=0.85)
+    ax.set_xlabel(r'Average capillary diameter [$\mu\mathrm{m}$]', fontsize=16)
+    ax.set_ylabel(r'Capillary tortuosity', fontsize=16)
+    colorbar = fig.colorbar(points, ax=ax)
+    colorbar.set_label(r'Capillary length [$\mu\mathrm{m}$]', size=16)
+    fig.savefig(arg.odir + "/diam_tort.png", dpi=125, bbox_inches='tight',
+                pil_kwargs={'compress_level': 1})
 
     # Save diameter vs. length plot
-    plt.figure(dpi=125)
-    plt.xscale('log')
-    plt.yscale('log')
-    plt.scatter(x=diameter, y=length, s=40, c=tortuosity, cmap=plt.cm.viridis,
-                edgecolors='face', alpha=0.85)
-    plt.xlabel(r'Average capillary diameter [$\mu\mathrm{m}$]', fontsize=16)
-    plt.ylabel(r'Capillary length [$\mu\mathrm{m}$]', fontsize=16)
-    plt.colorbar().set_label(r'Capillary tortuosity', size=16)
-    plt.savefig(arg.odir + "/diam_length.png", dpi=125, bbox_inches='tight')
+    colorbar.remove()
+    ax.clear()
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    points = ax.scatter(x=diameter, y=length, s=40, c=tortuosity, cmap=plt.cm.viridis,
+                        edgecolors='face', alpha=0.85)
+    ax.set_xlabel(r'Average capillary diameter [$\mu\mathrm{m}$]', fontsize=16)
+    ax.set_ylabel(r'Capillary length [$\mu\mathrm{m}$]', fontsize=16)
+    colorbar = fig.colorbar(points, ax=ax)
+    colorbar.set_label(r'Capillary tortuosity', size=16)
+    fig.savefig(arg.odir + "/diam_length.png", dpi=125, bbox_inches='tight',
+                pil_kwargs={'compress_level': 1})